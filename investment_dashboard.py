@@ -1,14 +1,171 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import numpy_financial as npf
 import plotly.express as px
+import plotly.io as pio
 from datetime import datetime
 from fpdf import FPDF
 import io
 
 st.set_page_config(layout="wide", page_title="Investment Dashboard", page_icon="📊")
 
+REQUIRED_COLUMNS = ["Investment Name", "Cost", "Fair Value", "Date", "Fund Name"]
+
+# Display formats for the numeric columns of the investment table (screen and PDF)
+TABLE_FORMATS = {"Cost": "${:,.0f}", "Fair Value": "${:,.0f}", "MOIC": "{:.2f}x", "ROI": "{:.2%}", "Annualized ROI": "{:.2%}"}
+
+# Coordinates for basic cities (customize as needed)
+HQ_COORDINATES = {
+    "Menlo Park, CA": (37.452959, -122.181725),
+    "Mountain View, CA": (37.3861, -122.0839),
+    "Newport Beach, CA": (33.6189, -117.9298),
+    "Providence, RI": (41.8240, -71.4128),
+    "Harris County, TX": (29.8579, -95.3936),
+    "Cincinnati, OH": (39.1031, -84.5120),
+    "Ann Arbor, MI": (42.2808, -83.7430),
+    "San Francisco, CA": (37.7749, -122.4194),
+    "Cleveland, OH": (41.4993, -81.6944),
+    "Chicago, IL": (41.8781, -87.6298),
+    "Lansing, MI": (42.7325, -84.5555),
+    "Boston, MA": (42.3601, -71.0589),
+    "Grand Rapids, MI": (42.9634, -85.6681),
+    "Brooklyn, NY": (40.6782, -73.9442),
+    "Miami, FL": (25.7617, -80.1918),
+    "New York, NY": (40.7128, -74.0060),
+    "Nashville, TN": (36.1627, -86.7816),
+    "Waco, TX": (31.5493, -97.1467),
+    "Sunnyvale, CA": (37.3688, -122.0363),
+    "Hawthorne, NY": (41.1076, -73.7954),
+    "Boulder, CO": (40.01499, -105.2705),
+    "Palo Alto, CA": (37.4419, -122.1430),
+    "Oakland, CA": (37.8044, -122.2711),
+    "Carlsbad, CA": (33.1581, -117.3506),
+    "Tampa, FL": (27.9506, -82.4572),
+    "Columbus, OH": (39.9612, -82.9988)
+}
+HQ_COORDINATES_DF = pd.DataFrame.from_dict(HQ_COORDINATES, orient="index", columns=["Latitude", "Longitude"])
+
+GOLD_SHADES = ["#A67B43", "#BA905C", "#CEA574", "#E3BA8D", "#F7CFA5", "#FCE9D2", "#FFF5EA"]
+
+
+def performance_tiers(values: np.ndarray, high: float, mid: float) -> np.ndarray:
+    """Bucket values into 0 (>= high), 1 (>= mid), 2 (below mid) or -1 (missing)."""
+    return np.select([values >= high, values >= mid, values < mid], [0, 1, 2], default=-1)
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_and_normalize(file_bytes: bytes, today: pd.Timestamp) -> pd.DataFrame:
+    """Parse the uploaded workbook and derive per-investment metrics.
+
+    Cached on the raw file bytes and the as-of date so widget reruns skip
+    the Excel parse.
+    """
+    df = pd.read_excel(io.BytesIO(file_bytes), engine="calamine")
+    df.columns = df.columns.str.strip()  # Strip extra whitespace from headers
+    if df.columns.intersection(REQUIRED_COLUMNS).size != len(REQUIRED_COLUMNS):
+        return df
+
+    # Coerce types in one assign, then drop unusable rows with a single NaN scan
+    df = df.assign(**{
+        "Cost": pd.to_numeric(df["Cost"], errors="coerce"),
+        "Fair Value": pd.to_numeric(df["Fair Value"], errors="coerce"),
+        "Date": pd.to_datetime(df["Date"], errors="coerce"),
+    }).dropna(subset=["Cost", "Fair Value", "Date"])
+    df["Fund Name"] = df["Fund Name"].astype("category")
+    if "Realized / Unrealized" in df.columns:
+        df["Realized / Unrealized"] = df["Realized / Unrealized"].astype(str).str.strip().str.lower().astype("category")
+    if "Stage" in df.columns:
+        df["Stage"] = df["Stage"].astype("category")
+    # Arrow-backed strings keep the name search and City/State cleanup in vectorized kernels
+    for col in ("Investment Name", "City", "State"):
+        if col in df.columns:
+            df[col] = df[col].astype("string[pyarrow]")
+
+    cost = df["Cost"].to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        moic = df["Fair Value"].to_numpy() / cost
+    df["MOIC"] = moic
+    df["ROI"] = moic - 1.0
+
+    days = (today - df["Date"]).dt.days.to_numpy(dtype=np.int32)
+    years = days / 365.25
+    df["Years Held"] = years
+    # Closed-form two-cashflow IRR: (FV / Cost) ** (1 / years) - 1, only evaluated where defined
+    valid = (cost > 0) & (days > 0)
+    annualized = np.full(len(df), np.nan)
+    with np.errstate(invalid="ignore"):
+        annualized[valid] = np.power(moic[valid], 1.0 / years[valid]) - 1.0
+    df["Annualized ROI"] = annualized
+    return df
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def build_fund_figures(_df: pd.DataFrame, view_key: tuple) -> tuple:
+    """Build the MOIC, annualized ROI and capital allocation charts from per-fund sums.
+
+    The frame itself is not hashed; view_key identifies the upload and filter state.
+    """
+    fund_sums = _df.groupby("Fund Name", observed=True)[["Fair Value", "Cost", "Weighted Annualized ROI Contribution"]].sum()
+    moic_by_fund = (fund_sums["Fair Value"] / fund_sums["Cost"]).reset_index(name="Portfolio MOIC")
+    moic_by_fund["MOIC Label"] = moic_by_fund["Portfolio MOIC"].round(2).astype(str) + "x"
+    fig_moic = px.bar(moic_by_fund, x="Fund Name", y="Portfolio MOIC", title="MOIC per Fund", text="MOIC Label", color_discrete_sequence=["#B1874C"])
+
+    roi_fund = (
+        fund_sums["Weighted Annualized ROI Contribution"] / fund_sums["Cost"].where(fund_sums["Cost"] > 0)
+    ).reset_index(name="Weighted Annualized ROI")
+    fund_roi = roi_fund["Weighted Annualized ROI"]
+    roi_fund["Annualized ROI Label"] = (fund_roi * 100).round(1).astype(str).add("%").where(fund_roi.notnull(), "N/A")
+    fig_roi = px.bar(
+        roi_fund,
+        x="Fund Name",
+        y="Weighted Annualized ROI",
+        title="Weighted Annualized ROI per Fund",
+        text="Annualized ROI Label",
+        color_discrete_sequence=["#B1874C"]
+    )
+
+    pie_df = fund_sums["Cost"].reset_index()
+    fig_allocation = px.pie(pie_df, names="Fund Name", values="Cost", title="Capital Invested per Fund", color_discrete_sequence=GOLD_SHADES)
+    return fig_moic, fig_roi, fig_allocation
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def to_csv_bytes(_df: pd.DataFrame, view_key: tuple) -> bytes:
+    """Serialize the filtered investments once per upload and filter state."""
+    buffer = io.BytesIO()
+    _df.to_csv(buffer, index=False, encoding="utf-8")
+    return buffer.getvalue()
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def render_png(fig_json: str, width: int = 800, height: int = 480) -> bytes:
+    """Render a Plotly figure to PNG, reusing earlier renders of identical figures."""
+    return pio.to_image(pio.from_json(fig_json), format="png", width=width, height=height)
+
+
+@st.fragment
+def render_cost_value_chart(df: pd.DataFrame):
+    """Draw the cost/value timeline; switching Chart Mode reruns only this fragment.
+
+    Returns the cumulative figure for the PDF export, or None in Monthly Deployed mode.
+    """
+    chart_mode = st.selectbox("Chart Mode", ["Cumulative", "Monthly Deployed"], index=0)
+    if chart_mode == "Cumulative":
+        cost_value_df = (
+            df.set_index("Date")[["Cost", "Fair Value"]]
+            .resample("MS").sum().cumsum()
+            .rename_axis("Date Group").reset_index()
+        )
+        fig_cost_value = px.line(cost_value_df, x="Date Group", y=["Cost", "Fair Value"], title="Cumulative Cost vs Fair Value Over Time", color_discrete_sequence=["#B1874C", "#D4B885"])
+        st.plotly_chart(fig_cost_value, use_container_width=True, key="cost_value_chart")
+        return fig_cost_value
+
+    monthly_df = df.set_index("Date")["Cost"].resample("MS").sum().rename_axis("Month").reset_index()
+    fig_deployed = px.bar(monthly_df, x="Month", y="Cost", title="Monthly Deployed", color_discrete_sequence=["#B1874C"])
+    st.plotly_chart(fig_deployed, use_container_width=True, key="monthly_deployed_chart")
+    return None
+
+
 # Sidebar menu for export options
 with st.sidebar:
     st.header("🗕️ Export Options")
@@ -26,49 +183,28 @@ realization_options = ["All", "Realized", "Unrealized"]
 realization_filter = st.radio("Show Investments:", realization_options, horizontal=True)
 
 if uploaded_file is not None:
-    df = pd.read_excel(uploaded_file)
-    df.columns = df.columns.str.strip()  # Strip extra whitespace from headers
+    today = pd.Timestamp.today().normalize()
+    df = load_and_normalize(uploaded_file.getvalue(), today)
 
-    required_columns = ["Investment Name", "Cost", "Fair Value", "Date", "Fund Name"]
-    if not all(col in df.columns for col in required_columns):
-        st.error("Missing required columns in uploaded file. Please ensure headers match expected structure.")
+    missing_columns = pd.Index(REQUIRED_COLUMNS).difference(df.columns, sort=False)
+    if not missing_columns.empty:
+        st.error(f"Missing required columns in uploaded file: {', '.join(missing_columns)}. Please ensure headers match expected structure.")
     else:
-        df = df.dropna(subset=["Cost", "Fair Value", "Date"])
-        df["Date"] = pd.to_datetime(df["Date"], errors='coerce')
-        df = df.dropna(subset=["Date"])
-
-        df["MOIC"] = df["Fair Value"] / df["Cost"]
-
-        today = pd.Timestamp.today()
-        df["ROI"] = (df["Fair Value"] - df["Cost"]) / df["Cost"]
-        df["Years Held"] = (today - df["Date"]).dt.days / 365.25
-        df["Annualized ROI"] = df.apply(
-            lambda row: (row["MOIC"] ** (1 / row["Years Held"]) - 1) if row["Years Held"] > 0 else np.nan,
-            axis=1
-        )
-
-        unique_funds = sorted(df["Fund Name"].dropna().unique())
+        unique_funds = df["Fund Name"].cat.categories.tolist()
         selected_funds = st.multiselect("Select Fund(s)", options=unique_funds, default=unique_funds, key="fund_selector")
 
-        # Apply filters (FIXED + DEBUGGED)
-        df_filtered = df.copy()
-
-        # Apply Realized/Unrealized filter
-        if "Realized / Unrealized" in df_filtered.columns:
-            df_filtered["Realized / Unrealized"] = df_filtered["Realized / Unrealized"].astype(str).str.strip().str.lower()
-            if realization_filter != "All":
-                realization_filter_lower = realization_filter.lower()
-                df_filtered = df_filtered[df_filtered["Realized / Unrealized"] == realization_filter_lower]
-
-        # Apply Fund Name filter
-        df_filtered = df_filtered[df_filtered["Fund Name"].isin(selected_funds)]
-
-        df_filtered = df_filtered.reset_index(drop=True)
-
         # 🔍 Add search bar for investment name
         search_term = st.text_input("Search Investments by Name")
+
+        # Apply all filters through one combined mask (single copy of the frame)
+        mask = df["Fund Name"].isin(selected_funds)
+        if "Realized / Unrealized" in df.columns and realization_filter != "All":
+            mask &= df["Realized / Unrealized"] == realization_filter.lower()
         if search_term:
-            df_filtered = df_filtered[df_filtered["Investment Name"].str.contains(search_term, case=False, na=False)]
+            mask &= df["Investment Name"].str.contains(search_term, case=False, na=False)
+        df_filtered = df.loc[mask].reset_index(drop=True)
+        # Identifies the current view so cached helpers can skip hashing the frame
+        view_key = (uploaded_file.file_id, today, tuple(selected_funds), realization_filter, search_term)
 
         if df_filtered.empty:
             st.warning("No investments match the selected filters.")
@@ -77,12 +213,8 @@ if uploaded_file is not None:
             total_fair_value = df_filtered["Fair Value"].sum()
             portfolio_moic = total_fair_value / total_invested if total_invested != 0 else 0
             portfolio_roi = (total_fair_value - total_invested) / total_invested
-            total_days = (today - df_filtered["Date"].min()).days
-            df_filtered["Weighted Annualized ROI Contribution"] = df_filtered.apply(
-                lambda row: row["Annualized ROI"] * row["Cost"] if pd.notnull(row["Annualized ROI"]) else 0,
-                axis=1
-            )
-            portfolio_annualized_roi = df_filtered["Weighted Annualized ROI Contribution"].sum() / df_filtered["Cost"].sum()
+            df_filtered["Weighted Annualized ROI Contribution"] = (df_filtered["Annualized ROI"] * df_filtered["Cost"]).fillna(0)
+            portfolio_annualized_roi = df_filtered["Weighted Annualized ROI Contribution"].sum() / total_invested
 
             st.markdown("### :bar_chart: Summary")
             col1, col2, col3, col4, col5 = st.columns(5)
@@ -91,11 +223,13 @@ if uploaded_file is not None:
             col3.metric("Portfolio MOIC", f"{portfolio_moic:.2f}x", help="Multiple on Invested Capital (Fair Value / Cost)")
             col4.metric("Portfolio-Level ROI", f"{portfolio_annualized_roi:.1%}" if not np.isnan(portfolio_annualized_roi) else "N/A", help="Annualized return across all investments, weighted by capital")
 
-            realized_df = df_filtered[df_filtered["Realized / Unrealized"] == "realized"] if "Realized / Unrealized" in df_filtered.columns else pd.DataFrame()
-            unrealized_df = df_filtered[df_filtered["Realized / Unrealized"] == "unrealized"] if "Realized / Unrealized" in df_filtered.columns else pd.DataFrame()
-
-            realized_distributions = realized_df["Fair Value"].sum() if not realized_df.empty else 0
-            residual_value = unrealized_df["Fair Value"].sum() if not unrealized_df.empty else 0
+            if "Realized / Unrealized" in df_filtered.columns:
+                status = df_filtered["Realized / Unrealized"]
+                realized_distributions = df_filtered["Fair Value"][status == "realized"].sum()
+                residual_value = df_filtered["Fair Value"][status == "unrealized"].sum()
+            else:
+                realized_distributions = 0
+                residual_value = 0
             dpi = realized_distributions / total_invested if total_invested != 0 else np.nan
             tvpi = (realized_distributions + residual_value) / total_invested if total_invested != 0 else np.nan
 
@@ -103,52 +237,26 @@ if uploaded_file is not None:
             
             st.markdown("---")
             
+            fig1, fig2, fig3 = build_fund_figures(df_filtered, view_key)
+
             st.subheader(":bar_chart: Portfolio MOIC by Fund")
-            moic_by_fund = df_filtered.groupby("Fund Name").apply(lambda x: x["Fair Value"].sum() / x["Cost"].sum()).reset_index(name="Portfolio MOIC")
-            moic_by_fund["MOIC Label"] = moic_by_fund["Portfolio MOIC"].round(2).astype(str) + "x"
-            fig1 = px.bar(moic_by_fund, x="Fund Name", y="Portfolio MOIC", title="MOIC per Fund", text="MOIC Label", color_discrete_sequence=["#B1874C"] * len(moic_by_fund))
-            st.plotly_chart(fig1, use_container_width=True)
+            st.plotly_chart(fig1, use_container_width=True, key="fund_moic_chart")
 
             st.subheader(":chart_with_upwards_trend: Annualized ROI by Fund")
-            roi_fund = df_filtered.groupby("Fund Name").apply(
-                lambda x: np.average(x["Annualized ROI"], weights=x["Cost"]) if x["Cost"].sum() > 0 else np.nan
-            ).reset_index(name="Weighted Annualized ROI")
-            roi_fund["Annualized ROI Label"] = roi_fund["Weighted Annualized ROI"].apply(lambda x: f"{x:.1%}" if pd.notnull(x) else "N/A")
-            fig2 = px.bar(
-                roi_fund,
-                x="Fund Name",
-                y="Weighted Annualized ROI",
-                title="Weighted Annualized ROI per Fund",
-                text="Annualized ROI Label",
-                color_discrete_sequence=["#B1874C"] * len(roi_fund)
-            )
-            st.plotly_chart(fig2, use_container_width=True)
+            st.plotly_chart(fig2, use_container_width=True, key="fund_roi_chart")
 
             st.subheader(":moneybag: Capital Allocation by Fund")
-            pie_df = df_filtered.groupby("Fund Name")["Cost"].sum().reset_index()
-            gold_shades = ["#A67B43", "#BA905C", "#CEA574", "#E3BA8D", "#F7CFA5", "#FCE9D2", "#FFF5EA"]
-            fig3 = px.pie(pie_df, names="Fund Name", values="Cost", title="Capital Invested per Fund", color_discrete_sequence=gold_shades[:len(pie_df)])
-            st.plotly_chart(fig3, use_container_width=True)
+            st.plotly_chart(fig3, use_container_width=True, key="fund_allocation_chart")
 
             if "Stage" in df_filtered.columns:
                 st.subheader(":dna: Investments by Stage")
-                stage_df = df_filtered.groupby("Stage")["Cost"].sum().reset_index()
-                fig4 = px.pie(stage_df, names="Stage", values="Cost", title="Investments by Stage", color_discrete_sequence=gold_shades[:len(stage_df)])
-                st.plotly_chart(fig4, use_container_width=True)
+                stage_df = df_filtered.groupby("Stage", observed=True)["Cost"].sum().reset_index()
+                fig4 = px.pie(stage_df, names="Stage", values="Cost", title="Investments by Stage", color_discrete_sequence=GOLD_SHADES)
+                st.plotly_chart(fig4, use_container_width=True, key="stage_chart")
 
             if not search_term:
                 st.subheader(":bar_chart: Cost Basis vs Fair Value Since Inception")
-                chart_mode = st.selectbox("Chart Mode", ["Cumulative", "Monthly Deployed"], index=0)
-                if chart_mode == "Cumulative":
-                    df_filtered["Date Group"] = df_filtered["Date"].dt.to_period("M").dt.to_timestamp()
-                    cost_value_df = df_filtered.groupby("Date Group")[["Cost", "Fair Value"]].sum().sort_index().cumsum().reset_index()
-                    fig_cost_value = px.line(cost_value_df, x="Date Group", y=["Cost", "Fair Value"], title="Cumulative Cost vs Fair Value Over Time", color_discrete_sequence=["#B1874C", "#D4B885"])
-                    st.plotly_chart(fig_cost_value, use_container_width=True)
-                else:
-                    df_filtered["Month"] = df_filtered["Date"].dt.to_period("M").dt.to_timestamp()
-                    monthly_df = df_filtered.groupby("Month")["Cost"].sum().reset_index()
-                    fig_deployed = px.bar(monthly_df, x="Month", y="Cost", title="Monthly Deployed", color_discrete_sequence=["#B1874C"])
-                    st.plotly_chart(fig_deployed, use_container_width=True)
+                fig_cost_value = render_cost_value_chart(df_filtered[["Date", "Cost", "Fair Value"]])
             else:
                 st.subheader(":bar_chart: Cost vs Fair Value (Filtered View)")
                 search_chart_df = df_filtered.groupby("Investment Name")[["Cost", "Fair Value"]].sum().reset_index().melt(
@@ -165,47 +273,15 @@ if uploaded_file is not None:
                     title="Cost vs Fair Value for Selected Investments",
                     color_discrete_sequence=["#B1874C", "#D4B885"]
                 )
-                st.plotly_chart(fig_bar_filtered, use_container_width=True)
+                st.plotly_chart(fig_bar_filtered, use_container_width=True, key="search_cost_value_chart")
 
             
 
             # ✅ NEW: Location Heatmap at Bottom
             st.subheader(":world_map: Investment HQ Heatmap")
             if "City" in df_filtered.columns and "State" in df_filtered.columns:
-                df_filtered["CityState"] = df_filtered["City"].str.strip() + ", " + df_filtered["State"].str.strip()
-
-                # Coordinates for basic cities (customize as needed)
-                coords_dict = {
-                    "Menlo Park, CA": (37.452959, -122.181725),
-                    "Mountain View, CA": (37.3861, -122.0839),
-                    "Newport Beach, CA": (33.6189, -117.9298),
-                    "Providence, RI": (41.8240, -71.4128),
-                    "Harris County, TX": (29.8579, -95.3936),
-                    "Cincinnati, OH": (39.1031, -84.5120),
-                    "Ann Arbor, MI": (42.2808, -83.7430),
-                    "San Francisco, CA": (37.7749, -122.4194),
-                    "Cleveland, OH": (41.4993, -81.6944),
-                    "Chicago, IL": (41.8781, -87.6298),
-                    "Lansing, MI": (42.7325, -84.5555),
-                    "Boston, MA": (42.3601, -71.0589),
-                    "Grand Rapids, MI": (42.9634, -85.6681),
-                    "Brooklyn, NY": (40.6782, -73.9442),
-                    "Miami, FL": (25.7617, -80.1918),
-                    "New York, NY": (40.7128, -74.0060),
-                    "Nashville, TN": (36.1627, -86.7816),
-                    "Waco, TX": (31.5493, -97.1467),
-                    "Sunnyvale, CA": (37.3688, -122.0363),
-                    "Hawthorne, NY": (41.1076, -73.7954),
-                    "Boulder, CO": (40.01499, -105.2705),
-                    "Palo Alto, CA": (37.4419, -122.1430),
-                    "Oakland, CA": (37.8044, -122.2711),
-                    "Carlsbad, CA": (33.1581, -117.3506),
-                    "Tampa, FL": (27.9506, -82.4572),
-                    "Columbus, OH": (39.9612, -82.9988)
-                }
-
-                df_filtered["Latitude"] = df_filtered["CityState"].map(lambda x: coords_dict.get(x, (np.nan, np.nan))[0])
-                df_filtered["Longitude"] = df_filtered["CityState"].map(lambda x: coords_dict.get(x, (np.nan, np.nan))[1])
+                df_filtered["CityState"] = df_filtered["City"].str.strip().str.cat(df_filtered["State"].str.strip(), sep=", ")
+                df_filtered = df_filtered.drop(columns=["Latitude", "Longitude"], errors="ignore").join(HQ_COORDINATES_DF, on="CityState")
 
                 geo_df = df_filtered.dropna(subset=["Latitude", "Longitude"])
 
@@ -215,13 +291,12 @@ if uploaded_file is not None:
                         lat="Latitude",
                         lon="Longitude",
                         hover_name="Investment Name",
-                        color="Investment Name",
                         size="Cost",
                         projection="albers usa",
-                        color_discrete_sequence=["#B1874C"] * len(geo_df["Investment Name"].unique())
+                        color_discrete_sequence=["#B1874C"]
                     )
                     fig_map.update_layout(geo=dict(bgcolor='rgba(0,0,0,0)'))
-                    st.plotly_chart(fig_map, use_container_width=True)
+                    st.plotly_chart(fig_map, use_container_width=True, key="hq_map")
                 else:
                     st.info("Map data columns exist but contain no usable location data.")
             else:
@@ -231,96 +306,72 @@ if uploaded_file is not None:
 
             # 💰 Top Value Creators (by $ gain)
             df_filtered["$ Gain"] = df_filtered["Fair Value"] - df_filtered["Cost"]
-            top_gainers = df_filtered.sort_values("$ Gain", ascending=False).head(3)["Investment Name"].tolist()
+            top_gainers = df_filtered.nlargest(3, "$ Gain")["Investment Name"].tolist()
 
             # 📉 Biggest Losses (by $ loss)
-            df_filtered["$ Loss"] = df_filtered["Cost"] - df_filtered["Fair Value"]
-            df_filtered_loss_only = df_filtered[df_filtered["$ Loss"] > 0]
-            top_losers = df_filtered_loss_only.sort_values("$ Loss", ascending=False).head(3)["Investment Name"].tolist()
+            df_filtered["$ Loss"] = -df_filtered["$ Gain"]
+            df_filtered_loss_only = df_filtered[df_filtered["$ Gain"].to_numpy() < 0]
+            top_losers = df_filtered_loss_only.nlargest(3, "$ Loss")["Investment Name"].tolist()
 
             # 🏋️ Highest Conviction (by Cost)
-            top_allocations = df_filtered.sort_values("Cost", ascending=False).head(3)["Investment Name"].tolist()
+            top_allocations = df_filtered.nlargest(3, "Cost")["Investment Name"].tolist()
 
             # ⚡ Most Efficient (low cost, high ROI)
-            efficient_df = df_filtered[df_filtered["Cost"] < df_filtered["Cost"].median()]  # small bets
-            efficient_df = efficient_df[efficient_df["Annualized ROI"].notnull()]
-            top_efficient = efficient_df.sort_values("Annualized ROI", ascending=False).head(3)["Investment Name"].tolist()
+            efficient_df = df_filtered[(df_filtered["Cost"] < df_filtered["Cost"].median()) & df_filtered["Annualized ROI"].notnull()]  # small bets
+            top_efficient = efficient_df.nlargest(3, "Annualized ROI")["Investment Name"].tolist()
 
             st.markdown(f"**💰 Largest Value Gains:** {', '.join(top_gainers)}")
             st.markdown(f"**📉 Largest Losses:** {', '.join(top_losers) if top_losers else 'None'}")
             st.markdown(f"**🏋️ Highest Conviction Bets:** {', '.join(top_allocations)}")
             st.markdown(f"**⚡ Most Efficient Bets:** {', '.join(top_efficient)}")
 
-            def highlight(val):
-                return "background-color: #ffe6e6" if isinstance(val, float) and val < 0 else ""
-
             st.markdown(f"### :abacus: Investment Table – Investments in View: {len(df_filtered)}")
-            df_filtered["MOIC"] = df_filtered["MOIC"].round(2).astype(str) + "x"
-            df_filtered_display = df_filtered.copy()
-            df_filtered_display["Cost"] = df_filtered_display["Cost"].apply(lambda x: f"${x:,.0f}")
-            df_filtered_display["Fair Value"] = df_filtered_display["Fair Value"].apply(lambda x: f"${x:,.0f}")
-            df_filtered_display["ROI"] = df_filtered_display["ROI"].apply(lambda x: f"{x:.2%}")
-            df_filtered_display["Annualized ROI"] = df_filtered_display["Annualized ROI"].apply(lambda x: f"{x:.2%}" if pd.notnull(x) else "N/A")
             summary_row = pd.DataFrame({
                 "Investment Name": ["Total"],
                 "Fund Name": ["-"],
-                "Cost": [f"${df_filtered['Cost'].sum():,.0f}"],
-                "Fair Value": [f"${df_filtered['Fair Value'].sum():,.0f}"],
-                "MOIC": [f"{portfolio_moic:.2f}x"],
-                "ROI": [f"{portfolio_roi:.2%}"],
-                "Annualized ROI": [f"{portfolio_annualized_roi:.2%}" if not np.isnan(portfolio_annualized_roi) else "N/A"]
+                "Cost": [total_invested],
+                "Fair Value": [total_fair_value],
+                "MOIC": [portfolio_moic],
+                "ROI": [portfolio_roi],
+                "Annualized ROI": [portfolio_annualized_roi]
             })
             df_with_total = pd.concat([
-                df_filtered_display[["Investment Name", "Fund Name", "Cost", "Fair Value", "MOIC", "ROI", "Annualized ROI"]],
+                df_filtered[["Investment Name", "Fund Name", "Cost", "Fair Value", "MOIC", "ROI", "Annualized ROI"]],
                 summary_row
             ], ignore_index=True)
-            def style_moic(val):
-                try:
-                    val_float = float(val.replace("x", ""))
-                    if val_float >= 2:
-                        return "background-color: #d4edda"  # green
-                    elif val_float >= 1:
-                        return "background-color: #fff3cd"  # yellow
-                    else:
-                        return "background-color: #f8d7da"  # red
-                except:
-                    return ""
-
-            def style_roi(val):
-                try:
-                    val_float = float(val.strip('%')) / 100
-                    if val_float >= 0.20:
-                        return "background-color: #d4edda"
-                    elif val_float >= 0.10:
-                        return "background-color: #fff3cd"
-                    else:
-                        return "background-color: #f8d7da"
-                except:
-                    return ""
+            # Tier backgrounds: green / yellow / red, then unstyled for missing values
+            tier_css = np.array(["background-color: #d4edda", "background-color: #fff3cd", "background-color: #f8d7da", ""])
+
+            def style_moic(col):
+                return tier_css[performance_tiers(col.to_numpy(dtype=np.float64), 2, 1)]
 
-            styled_df = df_with_total.style.applymap(style_moic, subset=["MOIC"]).applymap(style_roi, subset=["ROI"])
+            def style_roi(col):
+                return tier_css[performance_tiers(col.to_numpy(dtype=np.float64), 0.20, 0.10)]
+
+            styled_df = (
+                df_with_total.style
+                .format(TABLE_FORMATS, na_rep="N/A")
+                .apply(style_moic, subset=["MOIC"])
+                .apply(style_roi, subset=["ROI"])
+            )
             st.dataframe(styled_df)
 
             if download_csv:
                 # 🎯 Clean CSV Export Section (only show when data is filtered and ready)
-                csv_ready = df_filtered.to_csv(index=False).encode("utf-8")
                 st.download_button(
-                  label="⬇️ Download Filtered Investments CSV",
-                  data=csv_ready,
-                  file_name="filtered_investments.csv",
-                 mime="text/csv",
-                 help="Exports only the currently visible data after filters are applied"
+                    label="⬇️ Download Filtered Investments CSV",
+                    data=to_csv_bytes(df_filtered, view_key),
+                    file_name="filtered_investments.csv",
+                    mime="text/csv",
+                    help="Exports only the currently visible data after filters are applied"
                 )
 
 
             if download_pdf:
                 from PIL import Image
-                import plotly.io as pio
                 import os
                 import tempfile
 
-                pio.kaleido.scope.default_format = "png"
-
                 buffer_dir = tempfile.mkdtemp()
                 chart_paths = []
                 chart_titles = ["MOIC by Fund", "Annualized ROI by Fund", "Capital Allocation", "Stage Breakdown", "Cost vs Fair Value Over Time", "Investment HQ Map"]
@@ -330,7 +381,8 @@ if uploaded_file is not None:
                 for i, fig in enumerate(figs):
                     if fig:
                         path = os.path.join(buffer_dir, f"chart_{i}.png")
-                        pio.write_image(fig, path, format='png', width=1000, height=600)
+                        with open(path, "wb") as f:
+                            f.write(render_png(fig.to_json()))
                         chart_paths.append((chart_titles[i], path))
 
                 pdf = FPDF()
@@ -381,44 +433,31 @@ if uploaded_file is not None:
                 for i, header in enumerate(col_headers):
                     pdf.cell(col_widths[i], 10, header, border=1)
                 pdf.ln()
-                for _, row in df_with_total.iterrows():
+
+                # Format cells and pick fill colours per column up front, not per cell
+                tier_fills = [(212, 237, 218), (255, 243, 205), (248, 215, 218)]  # green / yellow / red
+                fill_tiers = {
+                    "MOIC": performance_tiers(df_with_total["MOIC"].to_numpy(dtype=np.float64), 2, 1),
+                    "Annualized ROI": performance_tiers(df_with_total["Annualized ROI"].to_numpy(dtype=np.float64), 0.20, 0.10),
+                }
+                cell_texts = {}
+                for col in col_headers:
+                    cell_format = TABLE_FORMATS.get(col)
+                    if cell_format is None:
+                        cell_texts[col] = [str(v)[:20] for v in df_with_total[col]]
+                    else:
+                        cell_texts[col] = [(cell_format.format(v) if pd.notnull(v) else "N/A")[:20] for v in df_with_total[col]]
+
+                for r in range(len(df_with_total)):
                     for i, col in enumerate(col_headers):
-                        cell_text = str(row[col])[:20]
-                        bg_color = None
-
-                        if col == "MOIC":
-                            try:
-                                moic_val = float(row[col].replace("x", ""))
-                                if moic_val >= 2:
-                                    bg_color = (212, 237, 218)  # green
-                                elif moic_val >= 1:
-                                    bg_color = (255, 243, 205)  # yellow
-                                else:
-                                    bg_color = (248, 215, 218)  # red
-                            except:
-                                pass
-
-                        if col == "Annualized ROI":
-                            try:
-                                roi_val = float(row[col].replace("%", "")) / 100
-                                if roi_val >= 0.20:
-                                    bg_color = (212, 237, 218)
-                                elif roi_val >= 0.10:
-                                    bg_color = (255, 243, 205)
-                                else:
-                                    bg_color = (248, 215, 218)
-                            except:
-                                pass
-
-                        if bg_color:
-                            pdf.set_fill_color(*bg_color)
-                            pdf.cell(col_widths[i], 10, cell_text, border=1, fill=True)
+                        tier = fill_tiers[col][r] if col in fill_tiers else -1
+                        if tier >= 0:
+                            pdf.set_fill_color(*tier_fills[tier])
+                            pdf.cell(col_widths[i], 10, cell_texts[col][r], border=1, fill=True)
                         else:
-                            pdf.cell(col_widths[i], 10, cell_text, border=1)
+                            pdf.cell(col_widths[i], 10, cell_texts[col][r], border=1)
                     pdf.ln()
 
-                pdf_output = os.path.join(buffer_dir, "investment_report.pdf")
-                pdf.output(pdf_output)
-
-                with open(pdf_output, "rb") as f:
-                    st.download_button("⬇️ Download PDF Report", data=f, file_name="investment_report.pdf", mime="application/pdf")
+                # fpdf 1.7 returns the document as a latin-1 string with dest="S"
+                pdf_bytes = pdf.output(dest="S").encode("latin-1")
+                st.download_button("⬇️ Download PDF Report", data=pdf_bytes, file_name="investment_report.pdf", mime="application/pdf")